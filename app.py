@@ -5,12 +5,18 @@ Version scientifiquement validée avec ASRS v1.1
 """
 
 import streamlit as st
+import atexit
 import json
-import pandas as pd
+import logging
+import threading
+import time
+from collections import deque
 from datetime import datetime
-import gspread
-from google.oauth2.service_account import Credentials
 import os
+from constantes_asrs import (NB_QUESTIONS_ASRS, PCT_TABLE, Q_KEYS, Q_LABELS, Q_WIDGET_KEYS,
+                             SEUILS_PARTIE_A, SEUIL_PARTIE_B, ScoreASRS)
+
+logger = logging.getLogger(__name__)
 
 st.set_page_config(
     page_title="Questionnaire TDAH - ASRS v1.1",
@@ -18,74 +24,289 @@ st.set_page_config(
     layout="centered"
 )
 
+CONFIG_PATH = 'config.json'
+
+@st.cache_resource(show_spinner=False, max_entries=1)
+def _lire_config(path, mtime):
+    # La clé inclut la date de modification : un config.json modifié est relu,
+    # sinon le dict déjà parsé est partagé (en lecture seule) entre les reruns.
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
 def load_config():
     try:
-        with open('config.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return _lire_config(CONFIG_PATH, os.path.getmtime(CONFIG_PATH))
     except FileNotFoundError:
         st.error("❌ Fichier config.json introuvable !")
         return None
 
-def connect_to_gsheet():
-    try:
-        if 'gsheet_credentials' in st.secrets:
-            credentials_dict = dict(st.secrets['gsheet_credentials'])
-        else:
-            st.warning("⚠️ Pas de connexion Google Sheets configurée.")
-            return None
-        scope = ['https://spreadsheets.google.com/feeds',
-                 'https://www.googleapis.com/auth/drive']
-        credentials = Credentials.from_service_account_info(credentials_dict, scopes=scope)
-        client = gspread.authorize(credentials)
-        sheet_url = st.secrets.get('gsheet_url', '')
-        if sheet_url:
-            return client.open_by_url(sheet_url)
-        else:
-            st.warning("⚠️ URL Google Sheet non configurée.")
-            return None
-    except Exception as e:
-        st.warning(f"⚠️ Erreur de connexion Google Sheets: {str(e)}")
-        return None
+# gspread et google-auth sont importés dans les fonctions qui s'en servent :
+# les reruns qui ne font qu'afficher un formulaire n'en paient pas le coût.
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets',
+          'https://www.googleapis.com/auth/drive']
 
-def save_to_gsheet(spreadsheet, worksheet_name, data):
+@st.cache_resource(show_spinner=False)
+def _gsheets_configure():
     try:
-        try:
-            worksheet = spreadsheet.worksheet(worksheet_name)
-        except:
-            worksheet = spreadsheet.add_worksheet(title=worksheet_name, rows="1000", cols="50")
-            worksheet.append_row(list(data.keys()))
-        worksheet.append_row(list(data.values()))
-        return True
-    except Exception as e:
-        st.error(f"❌ Erreur lors de la sauvegarde: {str(e)}")
+        return 'gsheet_credentials' in st.secrets and bool(st.secrets.get('gsheet_url'))
+    except FileNotFoundError:
+        # Pas de secrets.toml (StreamlitSecretNotFoundError en hérite) : mode hors ligne.
         return False
 
+# Évalué une fois par processus : sans identifiants, l'envoi vers Google Sheets est ignoré.
+GSHEETS_ENABLED = _gsheets_configure()
+
+QUESTIONS_META = "QUESTIONS_META"
+
+def _publier_questions_meta(spreadsheet, config):
+    """Écrit l'intitulé de chaque question dans l'onglet QUESTIONS_META.
+
+    Les lignes de réponses ne contiennent que les scores ; le texte des
+    questions est retrouvé ici via la colonne `question` (Q1, PA_Q1, ...).
+    """
+    lignes = [['questionnaire', 'question', 'texte']]
+    for questionnaire_type in ("pre", "post", "retrospectif"):
+        section = config.get(f'questionnaire_{questionnaire_type}', {})
+        lignes.extend([questionnaire_type, Q_KEYS[i], question]
+                      for i, question in enumerate(section.get('questions', [])))
+    lignes.extend(['profil_atypique', f"PA_Q{i+1}", question]
+                  for i, question in enumerate(QUESTIONS_PROFIL_ATYPIQUE))
+    import gspread
+    try:
+        worksheet = spreadsheet.worksheet(QUESTIONS_META)
+    except gspread.WorksheetNotFound:
+        worksheet = spreadsheet.add_worksheet(title=QUESTIONS_META, rows=len(lignes), cols=3)
+    # Vidé d'abord : les questions retirées du config ne doivent pas y rester.
+    worksheet.clear()
+    worksheet.update(range_name='A1', values=lignes)
+
+def _ouvrir_spreadsheet():
+    # Appelée par le flush en arrière-plan, jamais pendant une soumission.
+    import gspread
+    from google.oauth2.service_account import Credentials
+    credentials = Credentials.from_service_account_info(st.secrets['gsheet_credentials'],
+                                                        scopes=SCOPES)
+    client = gspread.authorize(credentials)
+    return client.open_by_url(st.secrets['gsheet_url'])
+
+RESULTS_PATH = 'results.jsonl'
+
+class _JournalLocal:
+    """Fichier JSONL en ajout seul : enregistrement principal de chaque soumission."""
+
+    def __init__(self, path):
+        self.fichier = open(path, 'a', encoding='utf-8', buffering=1)
+        self.verrou = threading.Lock()
+
+    def ecrire(self, data):
+        ligne = json.dumps(data, ensure_ascii=False, default=str) + '\n'
+        with self.verrou:
+            self.fichier.write(ligne)
+
+# Les réponses sont recopiées vers Google Sheets en arrière-plan : regroupées
+# par onglet puis écrites par append_rows, soit après FLUSH_INTERVAL secondes,
+# soit dès que FLUSH_BATCH_SIZE lignes attendent. Un envoi en échec est retenté
+# avec un délai doublé à chaque fois, puis abandonné après FLUSH_MAX_ESSAIS
+# essais (les réponses restent dans results.jsonl).
+FLUSH_INTERVAL = 2.0
+FLUSH_BATCH_SIZE = 25
+FLUSH_MAX_ESSAIS = 5
+
+class _FileEnvoi:
+    """Réponses en attente d'envoi, par onglet, partagées par toutes les sessions."""
+
+    def __init__(self):
+        self.reponses = {}
+        self.onglets = {}
+        self.essais = {}
+        self.reprise = {}
+        self.verrou = threading.Lock()
+        self.verrou_envoi = threading.Lock()
+        self.minuteur = None
+        self.echeance = None
+        self.spreadsheet = None
+        self.meta = None
+        self.meta_publiee = False
+        atexit.register(self.vider, tout=True)
+
+    def _planifier(self, delai):
+        # Appelé avec self.verrou tenu ; ne fait qu'avancer l'échéance du minuteur.
+        echeance = time.monotonic() + delai
+        if self.minuteur is not None:
+            if self.echeance <= echeance:
+                return
+            self.minuteur.cancel()
+        self.echeance = echeance
+        self.minuteur = threading.Timer(delai, self.vider)
+        self.minuteur.daemon = True
+        self.minuteur.start()
+
+    def ajouter(self, worksheet_name, reponses):
+        with self.verrou:
+            file = self.reponses.setdefault(worksheet_name, deque())
+            file.extend(reponses)
+            pleine = len(file) >= FLUSH_BATCH_SIZE and worksheet_name not in self.reprise
+            self._planifier(0 if pleine else FLUSH_INTERVAL)
+
+    def publier_questions_meta(self, config):
+        # Une fois par processus, au premier envoi ; retenté aux flushes suivants en cas d'échec.
+        with self.verrou:
+            if not self.meta_publiee and self.meta is None:
+                self.meta = config
+                self._planifier(FLUSH_INTERVAL)
+
+    def _spreadsheet(self):
+        # Authentification OAuth et ouverture faites une seule fois par processus,
+        # dans le flush ; un échec est retenté au flush suivant.
+        if self.spreadsheet is None:
+            self.spreadsheet = _ouvrir_spreadsheet()
+        return self.spreadsheet
+
+    def _onglet(self, worksheet_name, reponses):
+        if worksheet_name not in self.onglets:
+            import gspread
+            spreadsheet = self._spreadsheet()
+            try:
+                worksheet = spreadsheet.worksheet(worksheet_name)
+                entetes = worksheet.row_values(1)
+            except gspread.WorksheetNotFound:
+                worksheet = spreadsheet.add_worksheet(title=worksheet_name, rows="1000", cols="50")
+                entetes = []
+            self.onglets[worksheet_name] = (worksheet, entetes)
+        worksheet, entetes = self.onglets[worksheet_name]
+        # Les lignes sont alignées sur l'en-tête existant de l'onglet, qui peut
+        # contenir des colonnes absentes des réponses (anciens onglets *_text).
+        manquantes = [k for k in dict.fromkeys(k for data in reponses for k in data)
+                      if k not in entetes]
+        if manquantes:
+            entetes = entetes + manquantes
+            worksheet.update(range_name='A1', values=[entetes])
+            self.onglets[worksheet_name] = (worksheet, entetes)
+        return worksheet, entetes
+
+    def _echec(self, worksheet_name, reponses, dernier_essai):
+        self.onglets.pop(worksheet_name, None)
+        essais = self.essais.get(worksheet_name, 0) + 1
+        if dernier_essai or essais >= FLUSH_MAX_ESSAIS:
+            logger.exception("Abandon de l'envoi de %d ligne(s) vers %s après %d essai(s) "
+                             "(elles restent dans %s)", len(reponses), worksheet_name,
+                             essais, RESULTS_PATH)
+            with self.verrou:
+                self.essais.pop(worksheet_name, None)
+                self.reprise.pop(worksheet_name, None)
+            return
+        delai = FLUSH_INTERVAL * 2 ** essais
+        logger.warning("Échec de l'envoi de %d ligne(s) vers %s (essai %d/%d), "
+                       "nouvel essai dans %.0f s", len(reponses), worksheet_name,
+                       essais, FLUSH_MAX_ESSAIS, delai)
+        with self.verrou:
+            self.essais[worksheet_name] = essais
+            self.reprise[worksheet_name] = time.monotonic() + delai
+            # Remises en tête de file pour garder l'ordre chronologique de l'onglet.
+            file = self.reponses.setdefault(worksheet_name, deque())
+            file.extendleft(reversed(reponses))
+
+    def vider(self, tout=False):
+        # Un seul flush à la fois, de la prise des lignes jusqu'à la replanification :
+        # un flush lancé pendant un envoi attend, puis trouve les lignes remises
+        # en tête (et l'éventuel délai de reprise) par celui-ci.
+        with self.verrou_envoi:
+            maintenant = time.monotonic()
+            with self.verrou:
+                if self.minuteur is not None:
+                    self.minuteur.cancel()
+                    self.minuteur = None
+                lots = []
+                for worksheet_name, file in self.reponses.items():
+                    if file and (tout or self.reprise.get(worksheet_name, 0) <= maintenant):
+                        lots.append((worksheet_name, list(file)))
+                        file.clear()
+                meta, self.meta = self.meta, None
+            if meta is not None:
+                try:
+                    _publier_questions_meta(self._spreadsheet(), meta)
+                    self.meta_publiee = True
+                except Exception as e:
+                    # Repris au flush suivant (par exemple la reprise des lignes en échec).
+                    logger.warning("Impossible de mettre à jour l'onglet %s : %s", QUESTIONS_META, e)
+                    with self.verrou:
+                        if self.meta is None:
+                            self.meta = meta
+            for worksheet_name, reponses in lots:
+                try:
+                    worksheet, entetes = self._onglet(worksheet_name, reponses)
+                    worksheet.append_rows([[data.get(k, '') for k in entetes] for data in reponses],
+                                          insert_data_option='INSERT_ROWS', table_range='A1')
+                except Exception:
+                    self._echec(worksheet_name, reponses, dernier_essai=tout)
+                else:
+                    with self.verrou:
+                        self.essais.pop(worksheet_name, None)
+                        self.reprise.pop(worksheet_name, None)
+            with self.verrou:
+                reprises = [self.reprise.get(name, maintenant)
+                            for name, file in self.reponses.items() if file]
+                if reprises and not tout:
+                    self._planifier(max(min(reprises) - time.monotonic(), FLUSH_INTERVAL))
+
+# Streamlit réexécute ce script à chaque rerun : journal et file doivent vivre
+# dans st.cache_resource pour être les mêmes d'un rerun et d'une session à l'autre.
+@st.cache_resource(show_spinner=False)
+def _journal_local(path):
+    return _JournalLocal(path)
+
+@st.cache_resource(show_spinner=False)
+def _file_envoi():
+    return _FileEnvoi()
+
+def save_to_gsheet(worksheet_name, data):
+    # Connexion, onglet et écriture sont faits par le minuteur de _FileEnvoi.
+    _file_envoi().ajouter(worksheet_name, [data])
+    return True
+
+def enregistrer_reponses(config, worksheet_name, data):
+    """Écrit la soumission dans results.jsonl et la recopie vers Google Sheets.
+
+    Renvoie True si au moins l'une des deux destinations a accepté la ligne.
+    """
+    enregistre = False
+    try:
+        _journal_local(RESULTS_PATH).ecrire(data)
+        enregistre = True
+    except OSError:
+        # Disque plein, système de fichiers en lecture seule... : Sheets reste tenté.
+        logger.exception("Impossible d'écrire dans %s", RESULTS_PATH)
+    if GSHEETS_ENABLED:
+        _file_envoi().publier_questions_meta(config)
+        enregistre = save_to_gsheet(worksheet_name, data) or enregistre
+    if not enregistre:
+        st.error("❌ Erreur lors de la sauvegarde des réponses.")
+    return enregistre
+
 def calculer_score_asrs(responses, config):
-    seuils_a = config.get('seuils_partie_a', [2, 3, 2, 2, 3, 3])
-    score_partie_a = 0
-    items_positifs_a = 0
-    for i in range(6):
-        score_i = responses.get(f'Q{i+1}', 0)
-        score_partie_a += score_i
-        if score_i >= seuils_a[i]:
-            items_positifs_a += 1
-    score_partie_b = 0
-    items_positifs_b = 0
-    for i in range(6, 18):
-        score_i = responses.get(f'Q{i+1}', 0)
-        score_partie_b += score_i
-        if score_i >= 3:
-            items_positifs_b += 1
+    seuils_a = config.get('seuils_partie_a', SEUILS_PARTIE_A)
+    scores = [responses.get(k, 0) for k in Q_KEYS]
+    score_partie_a = sum(scores[:6])
+    score_partie_b = sum(scores[6:])
+    items_positifs_a = sum(score >= seuil for score, seuil in zip(scores[:6], seuils_a))
+    items_positifs_b = sum(score >= SEUIL_PARTIE_B for score in scores[6:])
     score_total = score_partie_a + score_partie_b
-    return {
-        'score_total': score_total,
-        'score_max': 72,
-        'score_partie_a': score_partie_a,
-        'score_partie_b': score_partie_b,
-        'items_positifs_a': items_positifs_a,
-        'items_positifs_b': items_positifs_b,
-        'screening_positif': items_positifs_a >= 4
-    }
+    return ScoreASRS(
+        score_total=score_total,
+        score_max=72,
+        score_partie_a=score_partie_a,
+        score_partie_b=score_partie_b,
+        items_positifs_a=items_positifs_a,
+        items_positifs_b=items_positifs_b,
+        screening_positif=items_positifs_a >= 4,
+    )
+
+def _ts():
+    """Horodatage ISO du rerun en cours, calculé au plus une fois par rerun."""
+    ts = st.session_state.get('_rerun_ts')
+    if ts is None:
+        ts = st.session_state['_rerun_ts'] = datetime.now().isoformat()
+    return ts
 
 def show_consent_form(config):
     st.title("📋 Consentement éclairé")
@@ -106,11 +327,14 @@ def show_consent_form(config):
                 st.session_state['email'] = email
                 st.session_state['age'] = age
                 st.session_state['genre'] = genre
-                st.session_state['consent_date'] = datetime.now().isoformat()
+                st.session_state['consent_date'] = _ts()
                 st.success("✅ Consentement enregistré !")
                 st.rerun()
 
-def show_questionnaire(config, questionnaire_type):
+INTERTITRES_ASRS = {0: ("### Questions 1 à 6",), 6: ("---", "### Questions 7 à 18")}
+
+def get_questionnaire_spec(questionnaire_type, config):
+    """(titre, sous-titre, questions, échelle) d'un questionnaire ASRS, lus dans le config."""
     if questionnaire_type == "pre":
         title = "📝 Questionnaire PRÉ-intervention - ASRS v1.1"
         subtitle = "Évaluation AVANT de commencer la méthode"
@@ -123,26 +347,24 @@ def show_questionnaire(config, questionnaire_type):
         title = "📝 Questionnaire rétrospectif - ASRS v1.1"
         subtitle = "Pour les personnes ayant déjà suivi la méthode"
         questions = config['questionnaire_retrospectif']['questions']
+    return title, subtitle, questions, config['echelle_likert']
+
+def show_questionnaire(config, questionnaire_type):
+    title, subtitle, questions, echelle = get_questionnaire_spec(questionnaire_type, config)
     st.title(title)
     st.caption(subtitle)
     st.info("📌 **Important** : Répondez en pensant aux 6 derniers mois.")
-    echelle = config['echelle_likert']
+    options = range(len(echelle))
+    format_echelle = echelle.__getitem__
 
     with st.form("questionnaire_form"):
         responses = {}
-        st.markdown("### Questions 1 à 6")
-        for i in range(6):
-            st.markdown(f"**{i+1}. {questions[i]}**")
-            responses[f"Q{i+1}"] = st.radio(f"q{i+1}", range(len(echelle)),
-                format_func=lambda x: echelle[x], key=f"q_{i+1}", label_visibility="collapsed")
-            responses[f"Q{i+1}_text"] = questions[i]
-        st.markdown("---")
-        st.markdown("### Questions 7 à 18")
-        for i in range(6, 18):
-            st.markdown(f"**{i+1}. {questions[i]}**")
-            responses[f"Q{i+1}"] = st.radio(f"q{i+1}", range(len(echelle)),
-                format_func=lambda x: echelle[x], key=f"q_{i+1}", label_visibility="collapsed")
-            responses[f"Q{i+1}_text"] = questions[i]
+        for i, question in enumerate(questions[:NB_QUESTIONS_ASRS]):
+            for intertitre in INTERTITRES_ASRS.get(i, ()):
+                st.markdown(intertitre)
+            st.markdown(f"**{i+1}. {question}**")
+            responses[Q_KEYS[i]] = st.radio(Q_LABELS[i], options,
+                format_func=format_echelle, key=Q_WIDGET_KEYS[i], label_visibility="collapsed")
         if questionnaire_type in ["post", "retrospectif"]:
             st.markdown("---")
             satisfaction = st.slider("Niveau de satisfaction global", 0, 10, 5)
@@ -156,25 +378,25 @@ def show_questionnaire(config, questionnaire_type):
         submitted = st.form_submit_button("📨 Envoyer les réponses")
         if submitted:
             scores = calculer_score_asrs(responses, config)
+            score_total = scores.score_total
+            items_positifs_a = scores.items_positifs_a
             save_data = {
-                'timestamp': datetime.now().isoformat(),
+                'timestamp': _ts(),
                 'type_questionnaire': questionnaire_type,
                 'email': st.session_state.get('email', ''),
                 'age': st.session_state.get('age', ''),
                 'genre': st.session_state.get('genre', ''),
-                **{k: v for k, v in scores.items()},
-                'score_pourcentage': round((scores['score_total'] / 72) * 100, 1)
+                **scores._asdict(),
+                'score_pourcentage': PCT_TABLE[score_total],
+                **responses,
             }
-            save_data.update(responses)
-            spreadsheet = connect_to_gsheet()
-            if spreadsheet:
-                save_to_gsheet(spreadsheet, questionnaire_type.upper(), save_data)
+            if enregistrer_reponses(config, questionnaire_type.upper(), save_data):
                 st.success("✅ Réponses enregistrées !")
-            st.metric("Score total", f"{scores['score_total']}/72")
-            if scores['screening_positif']:
-                st.warning(f"Symptômes marqués ({scores['items_positifs_a']}/6 items Partie A)")
+            st.metric("Score total", f"{score_total}/72")
+            if scores.screening_positif:
+                st.warning(f"Symptômes marqués ({items_positifs_a}/6 items Partie A)")
             else:
-                st.success(f"Symptômes légers à modérés ({scores['items_positifs_a']}/6 items Partie A)")
+                st.success(f"Symptômes légers à modérés ({items_positifs_a}/6 items Partie A)")
 
 
 # ─── Questionnaire Profil Atypique - Betty Rossitto ───
@@ -261,7 +483,7 @@ Il manque de structure interne pour fonctionner.
 """)
 
 
-def show_questionnaire_profil_atypique():
+def show_questionnaire_profil_atypique(config):
     st.title("📝 Questionnaire Profil Atypique")
     st.caption("Questionnaire développé par Betty Rossitto — contact : bethisabea.rossitto@gmail.com")
     st.info("📌 Répondez en pensant à votre quotidien habituel. Il n'y a pas de bonnes ou mauvaises réponses.")
@@ -274,14 +496,13 @@ def show_questionnaire_profil_atypique():
                 f"pa_q{i+1}", range(len(ECHELLE_PROFIL)),
                 format_func=lambda x: ECHELLE_PROFIL[x],
                 key=f"pa_{i+1}", label_visibility="collapsed")
-            responses[f"PA_Q{i+1}_text"] = question
         submitted = st.form_submit_button("📨 Envoyer les réponses")
 
         if submitted:
             score_total = sum(responses[f"PA_Q{i+1}"] for i in range(len(QUESTIONS_PROFIL_ATYPIQUE)))
             score_max = len(QUESTIONS_PROFIL_ATYPIQUE) * 4
             save_data = {
-                'timestamp': datetime.now().isoformat(),
+                'timestamp': _ts(),
                 'type_questionnaire': 'profil_atypique',
                 'email': st.session_state.get('email', ''),
                 'age': st.session_state.get('age', ''),
@@ -291,14 +512,13 @@ def show_questionnaire_profil_atypique():
                 'score_pourcentage': round((score_total / score_max) * 100, 1)
             }
             save_data.update(responses)
-            spreadsheet = connect_to_gsheet()
-            if spreadsheet:
-                save_to_gsheet(spreadsheet, "PROFIL_ATYPIQUE", save_data)
+            if enregistrer_reponses(config, "PROFIL_ATYPIQUE", save_data):
                 st.success("✅ Réponses enregistrées !")
             afficher_analyse_profil_atypique(score_total)
 
 
 def main():
+    st.session_state.pop('_rerun_ts', None)
     config = load_config()
     if not config:
         st.stop()
@@ -326,7 +546,7 @@ def main():
     elif page == "Rétrospectif (anciens clients)":
         show_questionnaire(config, "retrospectif")
     elif page == "Profil Atypique":
-        show_questionnaire_profil_atypique()
+        show_questionnaire_profil_atypique(config)
     st.sidebar.markdown("---")
     st.sidebar.caption("💡 Méthode d'intégration multisensorielle")
     st.sidebar.caption("Version 1.0 - 2025")
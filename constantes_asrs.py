@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+Clés, seuils et type de résultat des 18 items ASRS.
+
+Module séparé d'app.py : Streamlit réexécute le script principal à chaque
+rerun, alors qu'un module importé n'est évalué qu'une fois par processus.
+"""
+
+from typing import NamedTuple
+
+NB_QUESTIONS_ASRS = 18
+
+Q_KEYS = tuple(f'Q{i+1}' for i in range(NB_QUESTIONS_ASRS))
+Q_LABELS = tuple(f'q{i+1}' for i in range(NB_QUESTIONS_ASRS))
+Q_WIDGET_KEYS = tuple(f'q_{i+1}' for i in range(NB_QUESTIONS_ASRS))
+
+SEUILS_PARTIE_A = (2, 3, 2, 2, 3, 3)
+SEUIL_PARTIE_B = 3
+
+# Pourcentage arrondi pour chacun des 73 scores totaux possibles (0 à 72).
+PCT_TABLE = tuple(round(i / 72 * 100, 1) for i in range(73))
+
+class ScoreASRS(NamedTuple):
+    score_total: int
+    score_max: int
+    score_partie_a: int
+    score_partie_b: int
+    items_positifs_a: int
+    items_positifs_b: int
+    screening_positif: bool